@@ -9,25 +9,41 @@ This script simulates the git-ai workload:
 - Notes contain JSON-like content (simulating authorship logs)
 """
 
+import argparse
 import subprocess
 import tempfile
 import shutil
 import time
 import os
-import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from pathlib import Path
 
+GIT = "/opt/homebrew/bin/git"
+COMMITTER = b"Test User <test@example.com>"
+
+# Fixed commit date (matches the note timestamps) so repeated runs produce
+# identical commit hashes and git never has to look up the current time
+COMMIT_DATE = "1759924800 +0000"
+
+# Environment for every git process, built once rather than per call
+BASE_ENV = {
+    **os.environ,
+    "GIT_AUTHOR_DATE": COMMIT_DATE,
+    "GIT_COMMITTER_DATE": COMMIT_DATE,
+}
+
 
 def run_git(cmd, cwd, env=None):
     """Run a git command and return the result."""
-    full_cmd = ["/opt/homebrew/bin/git"] + cmd
+    full_cmd = [GIT] + cmd
     result = subprocess.run(
         full_cmd,
         cwd=cwd,
         capture_output=True,
         text=True,
-        env={**os.environ, **(env or {})}
+        env={**BASE_ENV, **env} if env else BASE_ENV
     )
     if result.returncode != 0:
         print(f"Command failed: {' '.join(full_cmd)}")
@@ -35,34 +51,217 @@ def run_git(cmd, cwd, env=None):
     return result
 
 
+class GitSession:
+    """
+    Long-lived git plumbing processes for creating objects without a spawn per object.
+
+    All I/O is binary. Ref updates are queued on a single `git update-ref --stdin`
+    and applied together when the session exits cleanly.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self._procs = []
+
+    def __enter__(self):
+        self._cat_file = self._spawn(["cat-file", "--batch-check=%(objectname)"])
+        self._mktree = self._spawn(["mktree", "--batch"])
+        self._update_ref = self._spawn(["update-ref", "--stdin", "-z"], stdout=None)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # Drop queued ref updates rather than applying a partial batch
+            self._update_ref.kill()
+        for proc in self._procs:
+            if exc_type is None:
+                proc.stdin.close()
+            else:
+                # Flushing into the killed update-ref fails; don't let that
+                # replace the exception being propagated
+                with suppress(BrokenPipeError):
+                    proc.stdin.close()
+        for proc in self._procs:
+            if proc.wait() != 0 and exc_type is None:
+                print(f"Command failed: {' '.join(proc.args)}")
+        return False
+
+    def _spawn(self, cmd, stdout=subprocess.PIPE):
+        proc = subprocess.Popen(
+            [GIT] + cmd,
+            cwd=self.repo_path,
+            env=BASE_ENV,
+            stdin=subprocess.PIPE,
+            stdout=stdout,
+        )
+        self._procs.append(proc)
+        return proc
+
+    @staticmethod
+    def _request(proc, request):
+        proc.stdin.write(request)
+        proc.stdin.flush()
+        return proc.stdout.readline().strip().decode()
+
+    def resolve(self, rev):
+        """Resolve a revision to an object hash."""
+        return self._request(self._cat_file, b"%s\n" % rev.encode())
+
+    def hash_blob(self, content):
+        """Write content (bytes) as a blob and return its hash."""
+        result = subprocess.run(
+            [GIT, "hash-object", "-w", "--stdin"],
+            cwd=self.repo_path,
+            env=BASE_ENV,
+            input=content,
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            print(f"Command failed: {' '.join(result.args)}")
+            print(f"Error: {result.stderr.decode()}")
+        return result.stdout.strip().decode()
+
+    def mktree(self, entries):
+        """Write a tree from (mode, type, hash, name) entries and return its hash."""
+        request = b"".join(
+            b"%s %s %s\t%s\n" % tuple(field.encode() for field in entry)
+            for entry in entries
+        )
+        return self._request(self._mktree, request + b"\n")
+
+    def commit_tree(self, tree, parent, message):
+        """Create a commit of tree on top of parent and return its hash."""
+        result = subprocess.run(
+            [GIT, "commit-tree", tree, "-p", parent],
+            cwd=self.repo_path,
+            env=BASE_ENV,
+            input=message.encode(),
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            print(f"Command failed: {' '.join(result.args)}")
+            print(f"Error: {result.stderr.decode()}")
+        return result.stdout.strip().decode()
+
+    def update_ref(self, ref, new, old=None):
+        """
+        Queue a ref update, applied when the session exits.
+
+        If old is given, the whole transaction fails unless ref still points at it.
+        """
+        self._update_ref.stdin.write(
+            b"update %s\0%s\0%s\0" % (ref.encode(), new.encode(), (old or "").encode())
+        )
+
+
+def fetch_notes(repo_path, tracking_ref):
+    """Fetch origin's notes into tracking_ref with the same flags git-ai uses internally."""
+    return run_git([
+        "-c", "core.hooksPath=/dev/null",
+        "-c", "core.alternateRefsCommand=exit 0",
+        "fetch",
+        "--no-tags",
+        "--recurse-submodules=no",
+        "--no-write-fetch-head",
+        "--no-write-commit-graph",
+        "--no-auto-maintenance",
+        "origin",
+        f"+refs/notes/ai:{tracking_ref}",
+    ], repo_path)
+
+
+def write_commit_graph(repo_path):
+    """Write a commit-graph so commit lookups during fetch avoid parsing commit objects."""
+    return run_git(["commit-graph", "write", "--reachable", "--changed-paths"], repo_path)
+
+
+@contextmanager
+def fast_import(repo_path):
+    """Run a single git fast-import, yielding the process to write commands to its stdin."""
+    full_cmd = [GIT, "fast-import", "--quiet", "--date-format=raw"]
+    proc = subprocess.Popen(
+        full_cmd,
+        cwd=repo_path,
+        env=BASE_ENV,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    try:
+        yield proc
+    finally:
+        proc.stdin.close()
+        if proc.wait() != 0:
+            print(f"Command failed: {' '.join(full_cmd)}")
+
+
+def data(content):
+    """Encode a fast-import length-prefixed data block."""
+    return b"data %d\n%s\n" % (len(content), content)
+
+
+def write_notes(repo_path, notes, parent=None):
+    """
+    Attach (commit_hash, note_bytes) pairs to refs/notes/ai, one notes commit per
+    note, matching the history `git notes add` produces.
+
+    Pass parent="refs/notes/ai^0" to append to an existing notes ref.
+    """
+    committer = b"committer %s %s\n" % (COMMITTER, COMMIT_DATE.encode())
+
+    with fast_import(repo_path) as proc:
+        for commit, note_bytes in notes:
+            proc.stdin.write(b"commit refs/notes/ai\n" + committer)
+            proc.stdin.write(data(b"Notes added by benchmark\n"))
+            if parent:
+                # Only the first commit needs it; later ones chain automatically
+                proc.stdin.write(b"from %s\n" % parent.encode())
+                parent = None
+            proc.stdin.write(b"N inline %s\n" % commit.encode())
+            proc.stdin.write(data(note_bytes))
+
+
+# Authorship note skeleton; __COMMIT__ and __IDX__ are substituted per note.
+NOTE_SKELETON = {
+    "metadata": {
+        "schema_version": "3.0",
+        "commit": "__COMMIT__",
+        "timestamp": "2025-10-08T12:00:00Z"
+    },
+    "session": {
+        "id": "session___IDX__",
+        "checkpoints": [
+            {
+                "type": "user_prompt",
+                "content": "Implement feature __IDX__",
+                "timestamp": "2025-10-08T12:00:00Z"
+            },
+            {
+                "type": "ai_response",
+                "content": "Here's the implementation for feature __IDX__...",
+                "timestamp": "2025-10-08T12:01:00Z"
+            }
+        ]
+    },
+    "authorship": {
+        "ai_percentage": 0.75,
+        "human_percentage": 0.25
+    }
+}
+
+# Serialised once at import; JSON braces are escaped so only the
+# placeholders are substituted by str.format.
+NOTE_TEMPLATE = (
+    json.dumps(NOTE_SKELETON, separators=(",", ":"))
+    .replace("{", "{{")
+    .replace("}", "}}")
+    .replace("__COMMIT__", "{commit}")
+    .replace("__IDX__", "{idx}")
+)
+
+
 def generate_authorship_note(commit_hash, index):
-    """Generate a realistic authorship note JSON."""
-    return json.dumps({
-        "metadata": {
-            "schema_version": "3.0",
-            "commit": commit_hash,
-            "timestamp": "2025-10-08T12:00:00Z"
-        },
-        "session": {
-            "id": f"session_{index}",
-            "checkpoints": [
-                {
-                    "type": "user_prompt",
-                    "content": f"Implement feature {index}",
-                    "timestamp": "2025-10-08T12:00:00Z"
-                },
-                {
-                    "type": "ai_response",
-                    "content": f"Here's the implementation for feature {index}...",
-                    "timestamp": "2025-10-08T12:01:00Z"
-                }
-            ]
-        },
-        "authorship": {
-            "ai_percentage": 0.75,
-            "human_percentage": 0.25
-        }
-    }, indent=2)
+    """Generate a realistic authorship note as compact JSON bytes."""
+    return NOTE_TEMPLATE.format(commit=commit_hash, idx=index).encode()
 
 
 def create_test_repo(base_dir, name, num_commits, num_notes):
@@ -70,87 +269,132 @@ def create_test_repo(base_dir, name, num_commits, num_notes):
     repo_path = base_dir / name
     repo_path.mkdir()
 
-    print(f"Creating {name} with {num_commits} commits and {num_notes} notes...")
+    # Configs are built concurrently, so tag progress with the config directory
+    label = f"{base_dir.name}/{name}"
+    print(f"Creating {label} with {num_commits} commits and {num_notes} notes...")
 
     run_git(["init", "-b", "main"], repo_path)
     run_git(["config", "user.name", "Test User"], repo_path)
     run_git(["config", "user.email", "test@example.com"], repo_path)
 
-    # Create commits
-    test_file = repo_path / "test.txt"
-    commits = []
-    for i in range(num_commits):
-        test_file.write_text(f"Commit {i}\n")
-        run_git(["add", "test.txt"], repo_path)
-        run_git(["commit", "-m", f"Commit {i}"], repo_path)
+    # Create commits and their notes in one fast-import stream. After each
+    # commit, get-mark returns its hash so the note can embed it; the note
+    # is then committed to refs/notes/ai keyed by the commit's mark.
+    committer = b"committer %s %s\n" % (COMMITTER, COMMIT_DATE.encode())
+
+    with fast_import(repo_path) as proc:
+        for i in range(num_commits):
+            mark = i + 1
+            proc.stdin.write(b"commit refs/heads/main\nmark :%d\n" % mark + committer)
+            proc.stdin.write(data(b"Commit %d\n" % i))
+            proc.stdin.write(b"M 100644 inline test.txt\n")
+            proc.stdin.write(data(b"Commit %d\n" % i))
+
+            if i < num_notes:
+                proc.stdin.write(b"get-mark :%d\n" % mark)
+                proc.stdin.flush()
+                commit = proc.stdout.readline().strip().decode()
+
+                proc.stdin.write(b"commit refs/notes/ai\n" + committer)
+                proc.stdin.write(data(b"Notes added by benchmark\n"))
+                proc.stdin.write(b"N inline :%d\n" % mark)
+                proc.stdin.write(data(generate_authorship_note(commit, i)))
+
+            if (i + 1) % 1000 == 0:
+                print(f"  [{label}] Created {i + 1} commits...")
+
+    # Pack objects and refs so benchmarks measure a steady-state repo
+    # rather than loose-object lookups
+    run_git(["gc", "--quiet"], repo_path)
+    write_commit_graph(repo_path)
+
+    print(f"  ✓ Created {label}")
+    return repo_path
 
-        # Get the commit hash
-        result = run_git(["rev-parse", "HEAD"], repo_path)
-        commits.append(result.stdout.strip())
 
-        if (i + 1) % 1000 == 0:
-            print(f"  Created {i + 1} commits...")
+def _link_or_copy(src, dst):
+    # Object files are never modified once written, so hardlink them; refs,
+    # reflogs and the index can be rewritten or appended to and need a copy
+    if f"{os.sep}objects{os.sep}" in src:
+        os.link(src, dst)
+    else:
+        shutil.copy2(src, dst)
 
-    # Add notes to commits using refs/notes/ai
-    for i, commit in enumerate(commits[:num_notes]):
-        note_content = generate_authorship_note(commit, i)
-        run_git(["notes", "--ref=ai", "add", "-f", "-m", note_content, commit], repo_path)
 
-        if (i + 1) % 1000 == 0:
-            print(f"  Created {i + 1} notes...")
+def snapshot_repo(repo_path, snapshot_path):
+    """Copy a repository, hardlinking its objects so even large repos snapshot quickly."""
+    shutil.copytree(repo_path, snapshot_path, symlinks=True, copy_function=_link_or_copy)
+
+
+def restore_repo(snapshot_path, repo_path):
+    """Replace a repository with a fresh copy of its snapshot."""
+    shutil.rmtree(repo_path)
+    snapshot_repo(snapshot_path, repo_path)
 
-    print(f"  ✓ Created {name}")
-    return repo_path
 
+def clone_repo(source, dest, proto="local"):
+    """
+    Clone a repository.
 
-def clone_repo(source, dest):
-    """Clone a repository."""
-    run_git(["clone", str(source), str(dest)], source.parent)
+    proto="local" hardlinks objects from the source; proto="file" goes
+    through a file:// URL so clone and later fetches use the pack protocol.
+    """
+    if proto == "file":
+        run_git(["clone", source.resolve().as_uri(), str(dest)], source.parent)
+    else:
+        run_git(["clone", "--local", str(source), str(dest)], source.parent)
     # Fetch notes into tracking ref (simulating git-ai's fetch pattern)
     tracking_ref = "refs/notes/ai-remote/origin"
-    run_git(["fetch", "origin", f"+refs/notes/ai:{tracking_ref}"], dest)
+    fetch_notes(dest, tracking_ref)
     # Copy tracking ref to local notes ref
     run_git(["update-ref", "refs/notes/ai", tracking_ref], dest)
+    write_commit_graph(dest)
 
 
-def benchmark_fetch_merge(repo_path, num_new_notes):
+def benchmark_fetch_merge(repo_path, remote_path, num_new_notes):
     """Benchmark fetch and merge operations matching git-ai's workload."""
     print(f"\nBenchmarking with {num_new_notes} new commits and notes...")
 
-    # Get the remote repo path (origin)
-    result = run_git(["remote", "get-url", "origin"], repo_path)
-    remote_path = Path(result.stdout.strip())
-
     # Create new commits with notes in the remote (simulating work from another clone)
-    test_file = remote_path / "test.txt"
+    # Notes only care about commit hashes, so every new commit shares one
+    # prebuilt tree and differs only by message and parent. Each commit is a
+    # single commit-tree with no index or working-tree traffic.
     new_commits = []
 
-    for i in range(num_new_notes):
-        # Create a new commit
-        test_file.write_text(f"New commit {i}\n")
-        run_git(["add", "test.txt"], remote_path)
-        run_git(["commit", "-m", f"New commit {i}"], remote_path)
+    with GitSession(remote_path) as git:
+        blob = git.hash_blob(b"New commit\n")
+        tree = git.mktree([("100644", "blob", blob, "test.txt")])
+
+        parent = old_main = git.resolve("refs/heads/main")
+        for i in range(num_new_notes):
+            # Create a new commit
+            parent = git.commit_tree(tree, parent, f"New commit {i}\n")
+            new_commits.append(parent)
 
-        # Get the commit hash
-        result = run_git(["rev-parse", "HEAD"], remote_path)
-        commit_hash = result.stdout.strip()
-        new_commits.append(commit_hash)
+        git.update_ref("refs/heads/main", parent, old_main)
 
-        # Add a note to the new commit
-        note_content = generate_authorship_note(commit_hash, 100000 + i)
-        run_git(["notes", "--ref=ai", "add", "-f", "-m", note_content, commit_hash], remote_path)
+    # Add a note to each new commit, all through one fast-import
+    write_notes(
+        remote_path,
+        ((commit, generate_authorship_note(commit, 100000 + i)) for i, commit in enumerate(new_commits)),
+        parent="refs/notes/ai^0",
+    )
+    write_commit_graph(remote_path)
 
     # Simulate git-ai's pre-push fetch and merge workflow
     tracking_ref = "refs/notes/ai-remote/origin"
 
     # Benchmark fetch into tracking ref
     start = time.time()
-    result = run_git(
-        ["fetch", "origin", f"+refs/notes/ai:{tracking_ref}"],
-        repo_path
-    )
+    result = fetch_notes(repo_path, tracking_ref)
     fetch_time = time.time() - start
 
+    # Lower bound for the merge: "ours" keeps the local notes, so the cheapest
+    # possible outcome is rewriting refs/notes/ai with its current value
+    start = time.time()
+    result = run_git(["update-ref", "refs/notes/ai", "refs/notes/ai"], repo_path)
+    ref_update_time = time.time() - start
+
     # Benchmark merge from tracking ref into refs/notes/ai with "ours" strategy
     start = time.time()
     result = run_git(
@@ -159,7 +403,22 @@ def benchmark_fetch_merge(repo_path, num_new_notes):
     )
     merge_time = time.time() - start
 
-    return fetch_time, merge_time
+    return fetch_time, ref_update_time, merge_time
+
+
+def setup_config(base_dir, num_commits, num_notes, proto):
+    """Create an origin repo and clone for one configuration; returns the clone path."""
+    config_dir = base_dir / f"{num_commits}-{num_notes}"
+    config_dir.mkdir()
+
+    # Create origin repo
+    origin = create_test_repo(config_dir, "origin", num_commits, num_notes)
+
+    # Create clone
+    clone_path = config_dir / "clone"
+    print(f"\nCloning {config_dir.name}/origin...")
+    clone_repo(origin, clone_path, proto)
+    return clone_path
 
 
 def main():
@@ -171,57 +430,100 @@ def main():
         (100000, 100000),
     ]
 
-    # Allow override from command line
-    if len(sys.argv) > 1:
-        num = int(sys.argv[1])
-        test_configs = [(num, num)]
+    parser = argparse.ArgumentParser(
+        description="Benchmark git notes fetch and merge performance"
+    )
+    parser.add_argument(
+        "num",
+        nargs="?",
+        type=int,
+        help="Number of commits and notes (overrides the default configurations)"
+    )
+    parser.add_argument(
+        "--proto",
+        choices=["local", "file"],
+        default="local",
+        help="Clone via hardlinked local clone or the file:// pack protocol"
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("results.ndjson"),
+        help="File to append one JSON result per line to as each run completes"
+    )
+    args = parser.parse_args()
 
-    results = []
+    if args.num is not None:
+        test_configs = [(args.num, args.num)]
 
-    for num_commits, num_notes in test_configs:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmpdir = Path(tmpdir)
+    # Results are streamed to disk as they complete so partial data survives
+    # a crash partway through a multi-hour run
+    results_file = args.output.open("a", buffering=1)
+    results_start = args.output.stat().st_size
 
+    with results_file, tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+
+        # Repo setup dominates wall time and each config owns its own
+        # directory, so build all of them concurrently. Timed runs below
+        # stay sequential so they don't compete with setup for CPU or disk.
+        with ThreadPoolExecutor(max_workers=len(test_configs)) as pool:
+            clone_paths = list(pool.map(
+                lambda config: setup_config(tmpdir, *config, args.proto),
+                test_configs,
+            ))
+
+        for (num_commits, num_notes), clone_path in zip(test_configs, clone_paths):
             print(f"\n{'='*60}")
             print(f"Testing with {num_commits:,} commits and {num_notes:,} notes")
             print(f"{'='*60}")
 
-            # Create origin repo
-            origin = create_test_repo(tmpdir, "origin", num_commits, num_notes)
-
-            # Create clone
-            clone_path = tmpdir / "clone"
-            print(f"\nCloning repository...")
-            clone_repo(origin, clone_path)
+            # Snapshot both repos so every measurement starts from the same
+            # state instead of inheriting the previous run's new commits
+            origin_path = clone_path.parent / "origin"
+            snapshot_dir = clone_path.parent / "snapshot"
+            snapshot_repo(origin_path, snapshot_dir / "origin")
+            snapshot_repo(clone_path, snapshot_dir / "clone")
 
             # Run benchmarks with different amounts of new notes
-            for num_new in [10, 100, 500, 1000]:
-                fetch_time, merge_time = benchmark_fetch_merge(clone_path, num_new)
+            for run, num_new in enumerate([10, 100, 500, 1000]):
+                if run > 0:
+                    restore_repo(snapshot_dir / "origin", origin_path)
+                    restore_repo(snapshot_dir / "clone", clone_path)
+
+                fetch_time, ref_update_time, merge_time = benchmark_fetch_merge(
+                    clone_path, origin_path, num_new
+                )
 
                 result = {
                     "total_commits": num_commits,
                     "total_notes": num_notes,
                     "new_notes": num_new,
                     "fetch_time": fetch_time,
+                    "ref_update_time": ref_update_time,
                     "merge_time": merge_time,
                     "total_time": fetch_time + merge_time
                 }
-                results.append(result)
+                results_file.write(json.dumps(result) + "\n")
 
                 print(f"\n  With {num_new} new remote notes:")
                 print(f"    Fetch time:  {fetch_time:.3f}s")
+                print(f"    Ref update:  {ref_update_time:.3f}s (merge lower bound)")
                 print(f"    Merge time:  {merge_time:.3f}s")
                 print(f"    Total time:  {fetch_time + merge_time:.3f}s")
 
     # Print summary
-    print(f"\n{'='*60}")
+    print(f"\n{'='*72}")
     print("SUMMARY")
-    print(f"{'='*60}")
-    print(f"{'Total Notes':<15} {'New Notes':<12} {'Fetch (s)':<12} {'Merge (s)':<12} {'Total (s)':<12}")
-    print(f"{'-'*60}")
+    print(f"{'='*72}")
+    print(f"{'Total Notes':<15} {'New Notes':<12} {'Fetch (s)':<12} {'Ref (s)':<12} {'Merge (s)':<12} {'Total (s)':<12}")
+    print(f"{'-'*72}")
+    with args.output.open() as f:
+        f.seek(results_start)
+        results = [json.loads(line) for line in f]
     for r in results:
-        print(f"{r['total_notes']:<15,} {r['new_notes']:<12} "
-              f"{r['fetch_time']:<12.3f} {r['merge_time']:<12.3f} {r['total_time']:<12.3f}")
+        print(f"{r['total_notes']:<15,} {r['new_notes']:<12} {r['fetch_time']:<12.3f} "
+              f"{r['ref_update_time']:<12.3f} {r['merge_time']:<12.3f} {r['total_time']:<12.3f}")
 
 
 if __name__ == "__main__":
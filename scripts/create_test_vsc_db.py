@@ -40,19 +40,29 @@ def create_test_database(source_db: str, target_db: str, data_filters: dict):
     if os.path.exists(target_db):
         os.remove(target_db)
 
-    # Connect to both databases
-    source_conn = sqlite3.connect(source_db)
+    # Connect to the target and attach the source so rows are copied
+    # entirely inside SQLite rather than round-tripping through Python
     target_conn = sqlite3.connect(target_db)
 
-    source_cursor = source_conn.cursor()
+    # The target is a throwaway fixture, so skip journaling and fsyncs and
+    # manage the single write transaction explicitly
+    target_conn.isolation_level = None
+    target_conn.execute("PRAGMA journal_mode=OFF")
+    target_conn.execute("PRAGMA synchronous=OFF")
+    target_conn.execute("PRAGMA temp_store=MEMORY")
+
     target_cursor = target_conn.cursor()
 
     try:
+        # ATTACH is not allowed inside a transaction
+        target_cursor.execute("ATTACH DATABASE ? AS src", (source_db,))
+        target_cursor.execute("BEGIN IMMEDIATE")
+
         # Get all table schemas
-        source_cursor.execute(
-            "SELECT sql FROM sqlite_master WHERE type='table' AND sql IS NOT NULL"
+        target_cursor.execute(
+            "SELECT sql FROM src.sqlite_master WHERE type='table' AND sql IS NOT NULL"
         )
-        schemas = source_cursor.fetchall()
+        schemas = target_cursor.fetchall()
 
         # Create tables in target database
         for (schema,) in schemas:
@@ -65,37 +75,29 @@ def create_test_database(source_db: str, target_db: str, data_filters: dict):
                 print(f"Skipping data copy for table '{table_name}' (no filters)")
                 continue
 
-            # Get column names
-            source_cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = [row[1] for row in source_cursor.fetchall()]
+            # Prepare the INSERT prefix once per table. The target schema is a
+            # copy of the source, so columns line up without naming them.
+            insert_prefix = f"INSERT INTO main.{table_name} SELECT * FROM src.{table_name} WHERE "
 
             total_rows = 0
             for where_clause in where_clauses:
-                # Select data matching the WHERE clause
-                query = f"SELECT * FROM {table_name} WHERE {where_clause}"
-                source_cursor.execute(query)
-                rows = source_cursor.fetchall()
-
-                if rows:
-                    # Prepare INSERT statement
-                    placeholders = ",".join(["?"] * len(columns))
-                    insert_query = f"INSERT INTO {table_name} VALUES ({placeholders})"
-
-                    # Insert rows into target database
-                    target_cursor.executemany(insert_query, rows)
-                    total_rows += len(rows)
-                    print(f"Copied {len(rows)} rows from '{table_name}' WHERE {where_clause}")
+                # Copy rows matching the WHERE clause straight from the source
+                target_cursor.execute(insert_prefix + where_clause)
+                copied_rows = target_cursor.rowcount
+
+                if copied_rows:
+                    total_rows += copied_rows
+                    print(f"Copied {copied_rows} rows from '{table_name}' WHERE {where_clause}")
                 else:
                     print(f"No rows found in '{table_name}' WHERE {where_clause}")
 
             print(f"Total rows copied for '{table_name}': {total_rows}")
 
         # Commit changes
-        target_conn.commit()
+        target_cursor.execute("COMMIT")
         print(f"\nTest database created successfully at: {target_db}")
 
     finally:
-        source_conn.close()
         target_conn.close()
 
 